@@ -0,0 +1,176 @@
+# this script checks the URL chunking used by refetch() against the original
+# bisection algorithm: for random combinations of dimensions, the chunked URLs
+# must be within the API limit, cover exactly the same combinations, and never
+# require more requests than the original (nor fail where the original succeeded)
+
+import random
+import itertools
+import json
+import threading
+import requests
+from requests.adapters import BaseAdapter
+import wbgapi as wb
+
+def bisect_url(url, var, variables, **kwargs):
+    '''The original recursive bisection implementation of _refetch_url
+    '''
+
+    def subdivide(parts):
+        parts2 = []
+        for s in parts:
+            mp = int(len(s)/2)
+            of = s[mp:].find(';')
+            if of < 0:
+                parts2.append(s)
+            else:
+                parts2.extend([s[:mp+of], s[mp+of+1:]])
+
+        return parts2
+
+    kw = kwargs.copy()
+    parts = [kwargs[var]]
+    while True:
+        kw[var] = max(parts, key=len)
+        if len(url.format(**kw)) < wb.api_maxlen:
+            for elem in parts:
+                kw[var] = elem
+                yield url.format(**kw)
+
+            return
+
+        parts2 = subdivide(parts)
+        if len(parts) == len(parts2):
+            break
+
+        parts = parts2
+
+    if len(variables) == 0:
+        raise wb.URLError()
+
+    for elem in parts:
+        kw[var] = elem
+        for u2 in bisect_url(url, variables[0], variables[1:], **kw):
+            yield u2
+
+def urls(func, url, variables, limit=None, **kwargs):
+    try:
+        return list(itertools.islice(func(url, variables[0], variables[1:], **kwargs), limit))
+    except wb.URLError:
+        return None
+
+def split(result, variables):
+    '''Returns the values of each variable requested by each URL, as sets
+    '''
+
+    sets = []
+    for u in result:
+        parts = u.split('/')
+        sets.append([set(parts[parts.index(k) + 1].split(';')) for k in variables])
+
+    return sets
+
+def check(label, url, variables, **kwargs):
+    # the original can produce millions of URLs for some inputs, so we stop counting early
+    old = urls(bisect_url, url, variables, limit=5000, **kwargs)
+    if old is not None and len(old) == 5000:
+        return None
+
+    new = urls(wb._refetch_url, url, variables, **kwargs)
+    if old is not None:
+        assert new is not None, '{}: URLError where the original succeeded'.format(label)
+
+    if new is None:
+        return 0
+
+    assert max(map(len, new)) < wb.api_maxlen, '{}: URL exceeds the limit'.format(label)
+    if old is not None:
+        assert len(new) <= len(old), '{}: {} requests vs {} originally'.format(label, len(new), len(old))
+
+    # every combination must be requested exactly once: the URLs must be pairwise disjoint and
+    # together request as many combinations as there are
+    sets = split(new, variables)
+    for elem in sets:
+        assert all(x <= set(kwargs[k].split(';')) for (x, k) in zip(elem, variables)), '{}: unexpected values'.format(label)
+
+    for (a, b) in itertools.combinations(sets, 2):
+        assert not all(x & y for (x, y) in zip(a, b)), '{}: overlapping requests'.format(label)
+
+    total = 1
+    for k in variables:
+        total *= len(kwargs[k].split(';'))
+
+    requested = 0
+    for elem in sets:
+        n = 1
+        for x in elem:
+            n *= len(x)
+
+        requested += n
+
+    assert requested == total, '{}: {} of {} combinations requested'.format(label, requested, total)
+    return len(new)
+
+def tokens(prefix, n, maxpad=0):
+    return ';'.join('{}{:04d}{}'.format(prefix, i, 'X' * random.randint(0, maxpad)) for i in range(n))
+
+random.seed(1)
+names = ['series', 'economy', 'time', 'version', 'counterpart']
+for trial in range(400):
+    variables = names[:random.randint(1, 5)]
+    url = 'sources/2/' + '/'.join('{}/{{{}}}'.format(v, v) for v in variables)
+    kwargs = {}
+    for v in variables:
+        pad = random.choice([0, 3, 8, 20, 50, 150])
+        kwargs[v] = ';'.join('{}{}{}'.format(v[0].upper(), i, 'X' * random.randint(0, pad)) for i in range(random.randint(1, random.choice([5, 20, 60, 200]))))
+
+    check('trial {}'.format(trial), url, variables, **kwargs)
+
+# a single long token in a later dimension
+url = 'sources/2/series/{series}/economy/{economy}/time/{time}'
+n = check('long token', url, ['series', 'economy', 'time'],
+    series=tokens('S', 200), economy='USA;{};BRA'.format('Y' * 1000), time=';'.join('YR{}'.format(y) for y in range(1960, 2020)))
+print('long token: {} URLs'.format(n))
+
+# refetch() must stay lazy: count the requests made when a caller stops early. This uses a fake
+# transport that answers every query with 1 row per page, 10 pages per chunk
+class CountingAdapter(BaseAdapter):
+    def __init__(self):
+        super(CountingAdapter, self).__init__()
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        with self.lock:
+            self.requests += 1
+
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps([{'page': 1, 'pages': 10, 'per_page': 1, 'total': 10}, [{'id': request.url}]]).encode()
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+adapter = CountingAdapter()
+wb.configure_session(adapter=adapter)
+wb.cache_ttl = 0
+series = tokens('SP.POP.', 400)
+
+def count(rows):
+    adapter.requests = 0
+    g = wb.refetch('sources/2/series/{series}/country/{economy}', ['series', 'economy'], series=series, economy='USA', params={'per_page': 1})
+    for elem in itertools.islice(g, rows):
+        pass
+
+    g.close()
+    return adapter.requests
+
+assert count(1) == 1, 'first row of a chunked query: {} requests'.format(count(1))
+print('first row: {} request'.format(count(1)))
+
+# past the first chunk, at most one page per prefetched chunk and per prefetched page is in flight
+n = count(12)
+assert n <= 12 + 2 * wb.concurrency, 'first 12 rows: {} requests'.format(n)
+print('first 12 rows: {} requests'.format(n))
+print('ok')
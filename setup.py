@@ -26,5 +26,6 @@ setuptools.setup(
         "Development Status :: 5 - Production/Stable",
     ],
     install_requires=['requests', 'PyYAML', 'tabulate'],
+    extras_require={'brotli': ['brotli'], 'diskcache': ['diskcache'], 'ijson': ['ijson'], 'orjson': ['orjson']},
     python_requires='>=3.0',
 )
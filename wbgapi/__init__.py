@@ -5,8 +5,20 @@ metadata API with built-in pandas integration
 
 import urllib.parse
 import re
+import string
+import math
+import collections
+import concurrent.futures
+import threading
+import json
+import io
+import os
+from time import monotonic, sleep
 from functools import reduce
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.util import make_headers
 import warnings
 from tabulate import tabulate
 from . import series
@@ -26,6 +38,23 @@ try:
 except ImportError:
     pd = None
 
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# orjson is much faster than the standard library for large responses, so use it if available
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
 
 # defaults: these can be changed at runtime with reasonable results
 endpoint = 'https://api.worldbank.org/v2'
@@ -34,11 +63,157 @@ per_page = 1000          # you can increase this if you start getting 'service u
 db = 2
 proxies = None           # deprecated
 get_options = {}         # additional parameters passed to requests.get
+concurrency = 4          # maximum number of pages requested in parallel; set to 1 to fetch pages one at a time
+timeout = (5, 30)        # default (connect, read) timeout in seconds; get_options['timeout'] takes precedence
+cache_ttl = 3600         # seconds to keep API responses in memory; set to 0 to disable the response cache
+cache_maxsize = 512      # maximum number of API responses kept in memory
+cache_maxbytes = 64000000 # maximum total size of API responses kept in memory
+stream_minsize = 1000000 # responses larger than this many bytes aren't cached, and are parsed incrementally if ijson is installed
+cache_dir = None         # directory for persisting MRV and time period lookups across sessions (requires diskcache)
 
 # The maximum URL length is 1500 chars before it reports a server error. Internally we use a smaller
 # number for head room as well as to provide for the query string
 api_maxlen = 1400
 
+def _default_adapter():
+    '''Returns the HTTP adapter mounted on the module session: a small connection pool
+    that retries transient server errors. 429 responses are handled by _queryAPI
+    '''
+
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504], raise_on_status=False)
+    return HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+
+# all API calls go through this session so that paged requests reuse pooled keep-alive connections
+_session = requests.Session()
+_session.mount('https://', _default_adapter())
+_session.mount('http://', _default_adapter())
+
+# responses are highly compressible JSON, so ask for every encoding urllib3 can decode
+# (this includes brotli if it's installed)
+_session.headers.update({
+    'Accept-Encoding': make_headers(accept_encoding=True)['accept-encoding'],
+    'User-Agent': 'wbgapi/{} {}'.format(__version__, requests.utils.default_user_agent()),
+})
+
+class _RateLimiter():
+    '''Internal token bucket that limits API requests per second across all threads
+    '''
+
+    def __init__(self, rate):
+        self.lock = threading.Lock()
+        self.reset(rate)
+
+    def reset(self, rate):
+        with self.lock:
+            self.rate = rate
+            self.tokens = rate
+            self.updated = monotonic()
+
+    def wait(self):
+        with self.lock:
+            if not self.rate:
+                return
+
+            now = monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            # a negative balance reserves a slot in the future, so concurrent callers queue up
+            self.tokens -= 1
+            delay = -self.tokens / self.rate
+
+        if delay > 0:
+            sleep(delay)
+
+_rate_limiter = _RateLimiter(50)
+_max_throttle_retries = 5
+_max_throttle_delay = 60   # seconds
+
+def configure_session(adapter=None, headers=None, rate=None):
+    '''Configure the HTTP session used for all API requests
+
+    Arguments:
+        adapter:    a requests transport adapter (e.g., requests.adapters.HTTPAdapter) to mount
+                    for both http and https URLs. Pass None to keep the current adapter
+
+        headers:    dict of HTTP headers to add to every request. By default the session
+                    requests compressed responses (gzip, deflate, and brotli if installed)
+
+        rate:       maximum number of API requests per second (default: 50). Pass 0 to remove
+                    the limit or None to keep the current setting. Independently of this limit,
+                    requests that the API rejects with 429 (too many requests) are retried after
+                    the delay it asks for (at most 60 seconds)
+
+    Returns:
+        the underlying requests.Session object, for further customization
+
+    Example:
+        from requests.adapters import HTTPAdapter
+        wbgapi.configure_session(adapter=HTTPAdapter(pool_maxsize=32), headers={'Accept-Encoding': 'gzip'})
+    '''
+
+    if adapter is not None:
+        _session.mount('https://', adapter)
+        _session.mount('http://', adapter)
+
+    if headers:
+        _session.headers.update(headers)
+
+    if rate is not None:
+        _rate_limiter.reset(rate)
+
+    return _session
+
+# in-memory response cache: maps URLs to (expiration, response body), least recently used first
+_response_cache = collections.OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+def cache_clear():
+    '''Discard all API responses held in the in-memory cache
+
+    Example:
+        wbgapi.cache_clear()
+        wbgapi.cache_ttl = 0    # or disable caching altogether
+    '''
+
+    global _cache_bytes
+
+    with _cache_lock:
+        _response_cache.clear()
+        _cache_bytes = 0
+
+# persistent lookups are refreshed daily, which is as often as the API's MRV values change
+_lookup_ttl = 86400
+_lookup_cache = None
+_lookup_path = None
+
+def _cachedLookup(key, func):
+    '''Internal function that returns func(), persisting the result in cache_dir if configured
+    '''
+
+    global _lookup_cache, _lookup_path
+
+    if cache_dir is None:
+        return func()
+
+    if diskcache is None:
+        raise ModuleNotFoundError('you must install diskcache to use cache_dir')
+
+    # compare against the path we opened: diskcache expands both ~ and $VARS in cache.directory
+    path = os.path.expandvars(os.path.expanduser(cache_dir))
+    if _lookup_cache is None or _lookup_path != path:
+        _lookup_cache = diskcache.Cache(path)
+        _lookup_path = path
+
+    value = _lookup_cache.get(key)
+    if value is None:
+        value = func()
+        if value is not None:
+            _lookup_cache.set(key, value, expire=_lookup_ttl)
+
+    return value
+
 class APIError(Exception):
   def __init__(self,url,msg,code=None):
     self.msg  = msg
@@ -65,19 +240,40 @@ class URLError(Exception):
     pass
 
 class Metadata():
+    # optional metadata subsets, which some modules attach as dict attributes, and their display names
+    _subsets = {'series': 'Economy-Series', 'economies': 'Series-Economy', 'time': 'Series-Time'}
+
     def __init__(self,concept,id,name):
         self.concept = concept
         self.id = id
         self.name = name
         self.metadata = {}
+        self._repr_cache = None
+        self._html_cache = None
 
     def __repr__(self):
         return self.repr()
 
+    def _state(self, *args):
+        '''Returns a snapshot of everything that appears in the output. Rendering is relatively
+        expensive, so cached output is reused as long as the snapshot hasn't changed
+        '''
+
+        state = args + (self.concept, self.id, self.name, tuple(self.metadata.items()))
+        for k in self._subsets.keys():
+            if hasattr(self, k):
+                state += (k, tuple(getattr(self, k).items()))
+
+        return state
+
     def repr(self, q=None, padding=None):
         '''Same as __repr__ but includes formatting options
         '''
 
+        state = self._state(q, padding)
+        if self._repr_cache is not None and self._repr_cache[0] == state:
+            return self._repr_cache[1]
+
         def segment(d):
             return '\n--------\n'.join(['{}: {}'.format(k, abbreviate(v, q=q, padding=padding)) for k,v in d.items()]) + '\n'
             
@@ -87,17 +283,21 @@ class Metadata():
 
         s = '========\n{}: {}\n\n'.format(self.concept, label) +  segment(self.metadata)
 
-        subsets = {'series': 'Economy-Series', 'economies': 'Series-Economy', 'time': 'Series-Time'}
-        for k,v in subsets.items():
+        for k,v in self._subsets.items():
             if hasattr(self, k):
                 d = getattr(self, k)
                 if len(d):
                     s += '========\n{}\n\n'.format(v) + segment(d)
 
+        self._repr_cache = (state, s)
         return s
 
     def _repr_html_(self):
 
+        state = self._state()
+        if self._html_cache is not None and self._html_cache[0] == state:
+            return self._html_cache[1]
+
         def segment(concept, meta, id=None, name=None):
             if id and name:
                 s = '<h4>{}: {}, {}</h4>'.format(concept, id, name)
@@ -114,14 +314,15 @@ class Metadata():
             return s + tabulate(rows, tablefmt='html', headers=['Field', 'Value'])
 
         s = '<div class="wbgapi">' + segment(self.concept, self.metadata, id=self.id, name=self.name)
-        subsets = {'series': 'Economy-Series', 'economies': 'Series-Economy', 'time': 'Series-Time'}
-        for k,v in subsets.items():
+        for k,v in self._subsets.items():
             if hasattr(self, k):
                 d = getattr(self, k)
                 if len(d):
                     s += segment(v, d)
 
-        return s + '</div>'
+        s += '</div>'
+        self._html_cache = (state, s)
+        return s
 
 
 class MetadataCollection():
@@ -208,13 +409,11 @@ class Featureset():
 
     def table(self):
 
-        rows = []
         if len(self.items) == 0:
-            return rows
-
-        for row in self.items:
-            rows.append([row[k] for k in self.columns])
+            return []
 
+        columns = self.columns
+        rows = [[row[k] for k in columns] for row in self.items]
         rows.append(['', '{} elements'.format(len(rows))])
         return rows
 
@@ -261,34 +460,49 @@ def fetch(url, params={}, concepts=False, lang=None):
         For most use cases there are higher level functions that are easier and safer than
         calling fetch() directly. But it's still very useful for direct testing and discovery
         of the API.
+
+        After the first page, up to wbgapi.concurrency pages are requested in parallel
+        while the caller consumes earlier ones. Rows are still returned in page order.
+    '''
+
+    (rows, more) = _fetchFirst(url, params, concepts, lang)
+    yield from rows
+    yield from more
+
+def _fetchFirst(url, params, concepts, lang):
+    '''Internal function that requests the first page of a query (see fetch). Returns an iterator
+    over the rows of that page and a generator over the rows of the remaining pages, which are only
+    requested once the caller starts consuming it
     '''
 
     global endpoint, per_page
 
     params_ = {'per_page': per_page}
     params_.update(params)
-    params_['page'] = 1
+    params_.pop('page', None)
     params_['format'] = 'json'
 
-    totalRecords = None
     if lang is None:
        lang = globals()['lang']
 
-    recordsRead = 0
-    while totalRecords is None or recordsRead < totalRecords:
+    # only the page number changes from one request to the next, so we encode everything else once
+    base_url = '{}/{}/{}?{}&page='.format(endpoint, lang, url, urllib.parse.urlencode(params_))
 
-        url_ = '{}/{}/{}?{}'.format(endpoint, lang, url, urllib.parse.urlencode(params_))
-        (hdr,result) = _queryAPI(url_)
+    def page_url(page):
+        return base_url + str(page)
 
-        if totalRecords is None:
-            totalRecords = int(hdr['total'])
+    url_ = page_url(1)
+    (hdr,result) = _queryAPI(url_)
+    objects = _responseFormat(url_, result)
 
-        data = _responseObjects(url_, result, wantConcepts=concepts)
-        for elem in data:
-            yield elem
+    def more():
+        # the first page tells us how many remain, so the rest can be requested ahead of the caller
+        pages = math.ceil(int(hdr['total']) / max(int(hdr['per_page']), 1))
+        urls = [page_url(page) for page in range(2, pages+1)]
+        for (_,result2) in _lookahead(_queryAPI, urls):
+            yield from objects(result2, concepts)
 
-        recordsRead += int(hdr['per_page'])
-        params_['page'] += 1
+    return (objects(result, concepts), more())
 
 def refetch(url, variables, **kwargs):
     ''' repeating fetch: provides a variation of fetch() that allows URLs that exceed the maximium API limit to
@@ -306,6 +520,11 @@ def refetch(url, variables, **kwargs):
     Returns:
         A generator object
 
+    Notes:
+        If the URL must be chunked, the first pages of up to wbgapi.concurrency subsequent chunks
+        are requested in parallel once the caller moves past the first chunk. Rows are still returned
+        in the same order as if they were fetched sequentially
+
     Example:
         # fetch all indicators for Brazil and Argentina
         s = ';'.join([row['id'] for row in wbgapi.series.list()])
@@ -318,12 +537,20 @@ def refetch(url, variables, **kwargs):
     params   = kwargs.get('params', {})
 
     try:
-        for url2 in _refetch_url(url, variables[0], variables[1:], **kwargs):
-            for row in fetch(url2, params, concepts, lang):
-                yield row
+        urls = list(_refetch_url(url, variables[0], variables[1:], **kwargs))
     except URLError:
         raise ValueError('{}: parameters exceed the API\'s maximum limit'.format(url))
 
+    # the first chunk is fetched on its own, so callers that only want the first few rows
+    # don't pay for the others
+    yield from fetch(urls[0], params, concepts, lang)
+
+    # chunks are independent queries, so we request the first pages of several at once. The
+    # remaining pages of each chunk are only requested as the caller works through it
+    for (rows, more) in _lookahead(lambda url2: _fetchFirst(url2, params, concepts, lang), urls[1:]):
+        yield from rows
+        yield from more
+
 def get(url, params={}, concepts=False, lang=None):
     '''Return a single response from the API
 
@@ -354,7 +581,7 @@ def get(url, params={}, concepts=False, lang=None):
     url_ = '{}/{}/{}?{}'.format(endpoint, lang, url, urllib.parse.urlencode(params_))
     (hdr,result) = _queryAPI(url_)
     data = _responseObjects(url_, result, wantConcepts=concepts)
-    return data[0] if len(data) > 0 else None
+    return next(iter(data), None)
 
 
 def metadata(url, variables, concepts='all', **kwargs):
@@ -386,28 +613,26 @@ def metadata(url, variables, concepts='all', **kwargs):
     elif type(concepts) is str:
         concepts = [concepts]
 
-    def metafield(concept):
-        '''Subroutine for returning individual metadata elements
-        '''
-
-        for var in concept['variable']:
-            id = var['id']
-            for field in var['metatype']:
-                yield (concept['id'], var['id'], var.get('name'), field)
-    
     m = Metadata(None,None,None)
     for row in refetch(url, variables, concepts=True, **kwargs):
         if concepts and row['id'] not in concepts:
             continue
 
-        for (concept_name,variable_id,variable_name,field) in metafield(row):
-            if concept_name != m.concept or variable_id != m.id:
+        for var in row['variable']:
+            # collect each variable's fields in one pass. Consecutive records for the same
+            # concept and variable are merged into a single Metadata object
+            fields = {field['id']: field['value'] for field in var['metatype']}
+            if not fields:
+                continue
+
+            if row['id'] != m.concept or var['id'] != m.id:
                 if m.concept:
                     yield m
 
-                m = Metadata(concept_name, variable_id, variable_name)
-            
-            m.metadata[field['id']] = field['value']
+                m = Metadata(row['id'], var['id'], var.get('name'))
+                m.metadata = fields
+            else:
+                m.metadata.update(fields)
 
     if m.concept:
         yield m
@@ -480,43 +705,93 @@ def search2(q, footnotes='none',  db=None):
         # if there are no matches, the API returns an error in xml format
         pass
 
+def _lookahead(func, items, workers=None):
+    '''Internal generator that returns func(item) for each item in order, while calls
+    for up to "workers" subsequent items run in background threads
+    '''
+
+    if workers is None:
+        workers = concurrency
+
+    if workers <= 1 or len(items) <= 1:
+        for item in items:
+            yield func(item)
+
+        return
+
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= workers:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # if the caller stops early, don't wait on requests that haven't started
+            for future in pending:
+                future.cancel()
+
+# response header lookups, by type of the decoded response
+_header_formats = {
+    list: lambda result: result[0] if len(result) > 0 else None,   # looks like the v2 data API
+    dict: lambda result: result,                                    # looks like the new beta advanced API
+}
+
 def _responseHeader(url, result):
     '''Internal function to return the response header, which contains page information
     '''
 
-    if type(result) is list and len(result) > 0 and type(result[0]) is dict:
-        # looks like the v2 data API
-        return result[0]
-
-    if type(result) is dict:
-        # looks like the new beta advanced API
-        return result
+    header = _header_formats.get(type(result))
+    hdr = header(result) if header else None
+    if isinstance(hdr, dict):
+        return hdr
 
     raise APIError(url, 'Unrecognized response object format')
 
-def _responseObjects(url, result, wantConcepts=False):
-    '''Internal function that returns an array of objects
+def _v2Objects(result, wantConcepts):
+    return iter(result[1])
+
+def _conceptObjects(result, wantConcepts):
+    # this format is used for metadata and concept lists. Caller may need an array of concepts or
+    # an array of the variables of the first concept
+    if wantConcepts:
+        return iter(result['source'][0]['concept'])
+
+    return iter(result['source'][0]['concept'][0]['variable'])
+
+def _dataObjects(result, wantConcepts):
+    # this format is used to return data in the beta endpoints
+    return iter(result['source']['data'])
+
+def _responseFormat(url, result):
+    '''Internal function that identifies the format of a response and returns the function
+    that extracts its objects. All pages of a query have the same format, so fetch() calls
+    this once and applies the returned function to each page. The function returns an iterator
     '''
 
-    if type(result) is list and len(result) > 1:
+    if isinstance(result, list) and len(result) > 1:
         # looks like the v2 data API
-        return result[1]
-
-    if type(result) is dict and result.get('source'):
-        if type(result['source']) is list and len(result['source']) > 0 and type(result['source'][0]) is dict:
-            # this format is used for metadata and concept lists. Caller may need an array of concepts or
-            # an array of the variables of the first concept
-            if wantConcepts:
-                return result['source'][0]['concept']
-            else:
-                return result['source'][0]['concept'][0]['variable']
+        return _v2Objects
+
+    if isinstance(result, dict) and result.get('source'):
+        source = result['source']
+        if isinstance(source, list) and len(source) > 0 and isinstance(source[0], dict):
+            return _conceptObjects
 
-        if type(result['source']) is dict:
-            # this format is used to return data in the beta endpoints
-            return result['source']['data']
+        if isinstance(source, dict):
+            return _dataObjects
 
     raise APIError(url, 'Unrecognized response object format')
 
+def _responseObjects(url, result, wantConcepts=False):
+    '''Internal function that returns an iterator over the objects in a response
+    '''
+
+    return _responseFormat(url, result)(result, wantConcepts)
+
 def _queryAPI(url):
     '''Internal function for calling the API with sanity checks
     '''
@@ -525,12 +800,38 @@ def _queryAPI(url):
         warnings.warn('"proxies" is deprecated and will be removed in a future release. Use "get_options" instead as described in the README', DeprecationWarning)
         params['proxies'] = proxies
 
-    response = requests.get(url, **params)
-    if response.status_code != 200:
-        raise APIError(url, response.reason, response.status_code)
+    content = _cacheGet(url)
+    cached = content is not None
+    if not cached:
+        params.setdefault('timeout', timeout)
+        for attempt in range(_max_throttle_retries + 1):
+            _rate_limiter.wait()
+            response = _session.get(url, **params)
+            if response.status_code != 429 or attempt == _max_throttle_retries:
+                break
+
+            # the API is throttling us: wait as long as it asks (within reason), or back off exponentially
+            try:
+                delay = float(response.headers['Retry-After'])
+            except (KeyError, ValueError):
+                delay = 2 ** attempt
+
+            if not math.isfinite(delay):
+                delay = 2 ** attempt
+
+            sleep(min(max(delay, 0), _max_throttle_delay))
+
+        if response.status_code != 200:
+            raise APIError(url, response.reason, response.status_code)
+
+        content = response.content
 
     try:
-        result = response.json()
+        if ijson is not None and len(content) > stream_minsize and content[:16].lstrip()[:1] == b'[':
+            # large v2 responses: parse the header now and the records as the caller consumes them
+            result = [next(ijson.items(io.BytesIO(content), 'item', use_float=True)), _streamObjects(url, content)]
+        else:
+            result = _loads(content)
     except:
         raise APIResponseError(url, 'JSON decoding error')
 
@@ -539,8 +840,69 @@ def _queryAPI(url):
         msg = hdr['message'][0]
         raise APIError(url, '{}: {}'.format(msg['key'], msg['value']))
 
+    if not cached:
+        _cachePut(url, content)
+
     return (hdr, result)
 
+def _streamObjects(url, content):
+    '''Internal generator that incrementally parses the records of a v2 API response
+    '''
+
+    try:
+        for elem in ijson.items(io.BytesIO(content), 'item.item', use_float=True):
+            yield elem
+    except ijson.JSONError:
+        raise APIResponseError(url, 'JSON decoding error')
+
+def _cacheGet(url):
+    '''Internal function to return a cached response body, or None if missing or expired
+    '''
+
+    if cache_ttl <= 0:
+        return None
+
+    global _cache_bytes
+
+    with _cache_lock:
+        entry = _response_cache.get(url)
+        if entry is None:
+            return None
+
+        (expires, content) = entry
+        if expires < monotonic():
+            del _response_cache[url]
+            _cache_bytes -= len(content)
+            return None
+
+        _response_cache.move_to_end(url)
+        return content
+
+def _cachePut(url, content):
+    '''Internal function to add a response body to the cache, evicting the least recently used
+    until the cache is within its size limits
+    '''
+
+    global _cache_bytes
+
+    # large responses are not cached: they would quickly crowd out everything else and
+    # defeat the purpose of parsing them incrementally
+    if cache_ttl <= 0 or len(content) > stream_minsize:
+        return
+
+    # we cache the raw body rather than the parsed objects because callers are free to modify
+    # the rows they receive
+    with _cache_lock:
+        entry = _response_cache.pop(url, None)
+        if entry is not None:
+            _cache_bytes -= len(entry[1])
+
+        _response_cache[url] = (monotonic() + cache_ttl, content)
+        _cache_bytes += len(content)
+        while len(_response_cache) > cache_maxsize or _cache_bytes > cache_maxbytes:
+            (_, (_, old)) = _response_cache.popitem(last=False)
+            _cache_bytes -= len(old)
+
 _concept_mrv_cache = {}
 
 def queryParam(arg, concept=None, db=None):
@@ -568,20 +930,27 @@ def queryParam(arg, concept=None, db=None):
             _concept_mrv_cache[db] = {}
 
         if _concept_mrv_cache[db].get(concept) is None:
-            for row in source.features(concept, db=db):
-                _concept_mrv_cache[db][concept] = row['id']
+            def mrv():
+                id = None
+                for row in source.features(concept, db=db):
+                    id = row['id']
+
+                return id
+
+            _concept_mrv_cache[db][concept] = _cachedLookup(('mrv', str(db), concept), mrv)
 
-        arg = _concept_mrv_cache[db].get(concept, '')
+        arg = _concept_mrv_cache[db].get(concept) or ''
         
     if type(arg) is str or type(arg) is int:
         arg = [arg]
 
     if concept == 'time':
-        v = time.periods(db)
-        return ';'.join(map(lambda x: str(v.get(str(x),x)), arg))
+        # time.periods() is memoized per database, so repeated calls are cheap
+        periods = time.periods(db)
+        return ';'.join([str(periods.get(str(x),x)) for x in arg])
 
     # this will throw an exception if arg is not iterable, which is what we want it to do
-    return ';'.join(map(lambda x:str(x), arg))
+    return ';'.join(map(str, arg))
 
 def Series(data, key='id', value='value', name=None):
     '''Convert a list-like to a pandas Series object. This core function is
@@ -617,7 +986,15 @@ def Series(data, key='id', value='value', name=None):
     if callable(data):
         data = data()
 
-    return pd.Series({row[key]: row[value] for row in data}, name=name)
+    # let pandas build the series from the records directly, which is faster than building
+    # an intermediate dict
+    df = pd.DataFrame.from_records(list(data), columns=[key, value])
+    if not df[key].is_unique:
+        # match dict construction: a repeated key keeps its first position and takes its last value
+        last = df.drop_duplicates(key, keep='last').set_index(key)[value]
+        df = last.reindex(df[key].drop_duplicates()).reset_index()
+
+    return pd.Series(df[value].values, index=df[key].values, name=name)
 
 def htmlTable(*args, **kwargs):
     '''Generates an HTML table wrapped in a <div class="wbgapi"/> to allow users
@@ -654,9 +1031,25 @@ def _refetch_url(url, var, variables, **kwargs):
 
     global api_maxlen
 
-    def subdivide(parts):
-        # split a long semicolon separated string into 2 roughly equal segments, on a semicolon boundary
+    def pack(values, room):
+        # greedily pack as many values into each chunk as will fit. A value that
+        # can't fit on its own goes into a chunk by itself
+        chunks = []
+        chunk = None
+        for elem in values:
+            if chunk is not None and len(chunk) + len(elem) + 1 < room:
+                chunk += ';' + elem
+            else:
+                if chunk is not None:
+                    chunks.append(chunk)
+
+                chunk = elem
 
+        chunks.append(chunk)
+        return chunks
+
+    def subdivide(parts):
+        # split each semicolon separated string into 2 roughly equal segments, on a semicolon boundary
         parts2 = []
         for s in parts:
             mp = int(len(s)/2)
@@ -666,41 +1059,90 @@ def _refetch_url(url, var, variables, **kwargs):
                 parts2.append(s)
             else:
                 parts2.extend([s[:mp+of], s[mp+of+1:]])
-        
+
         return parts2
 
-    kw = kwargs.copy()
-
-    # parts is an array of roughly equal chunks of the value for var. We first try to see
-    # if the entire string can be passed as one, else we chunk it into smaller and smaller pieces
-    parts = [kwargs[var]]
-    sz = None
-    while True:
-        kw[var] = max(parts, key=len)
-        test_url = url.format(**kw)
-        if len(test_url) < api_maxlen:
-            # we are small enough
-            for elem in parts:
-                kw[var] = elem
-                yield url.format(**kw)
-
-            return
-
-        # else, subdivide parts and try again
-        parts2 = subdivide(parts)
-        if len(parts) == len(parts2):
-            # can't subdivide any more
-            break
-        else:
+    variables = [var] + list(variables)
+
+    # the template never changes, so we parse it once. The length of any URL made from it is
+    # then the length of its literal text plus the lengths of the values, which lets us measure
+    # candidate URLs without formatting them
+    template = list(string.Formatter().parse(url))
+    literal = sum(len(text) for (text,_,_,_) in template)
+    fields = [name for (_,name,_,_) in template if name is not None]
+
+    def length(kw, *omit):
+        return literal + sum(len(str(kw[name])) for name in fields if name not in omit)
+
+    # the room available to the chunkable variables once everything else is in the URL
+    room = api_maxlen - length(kwargs, *variables)
+    values = [kwargs[k].split(';') for k in variables]
+    sizes = [len(kwargs[k]) for k in variables]
+
+    # candidate ways to chunk each variable when the variables after it need to be chunked too:
+    # greedy packing at a range of chunk sizes, plus each level of an even bisection. Only the
+    # lengths of the chunks matter to the cost of a candidate, so duplicates are dropped
+    candidates = []
+    for (n,k) in enumerate(values):
+        options = {}
+        longest = max(map(len, k))
+        for size in range(longest + 1, max(room, longest + 1) + 1, max(1, (room - longest) // 32)):
+            chunks = pack(k, size)
+            options.setdefault(tuple(sorted(collections.Counter(map(len, chunks)).items())), chunks)
+
+        parts = [kwargs[variables[n]]]
+        while True:
+            options.setdefault(tuple(sorted(collections.Counter(map(len, parts)).items())), parts)
+            parts2 = subdivide(parts)
+            if len(parts2) == len(parts):
+                break
+
             parts = parts2
 
-    # by now we've chunked as much as we can on var. If that's not enough, then we
-    # start chunking the next variable
-    if len(variables) == 0:
-        # if there's no more variables then we cry Uncle and give up
+        candidates.append(list(options.items()))
+
+    plans = {}
+    def plan(n, r):
+        # returns (number of URLs, chunks of variable n, whether later variables are chunked too)
+        # for the cheapest way to fit variable n and those after it into r characters
+        if (n, r) in plans:
+            return plans[(n, r)]
+
+        # first choice: pack variable n around the full value of the variables after it
+        free = r - sum(sizes[n+1:])
+        chunks = pack(values[n], free)
+        best = (len(chunks) if max(map(len, chunks)) < free else math.inf, chunks, False)
+
+        # otherwise, see if chunking the next variables as well is cheaper or even possible
+        if n + 1 < len(variables):
+            for (lengths, chunks) in candidates[n]:
+                if lengths[-1][0] < r:
+                    cost = sum(count * plan(n+1, r - size)[0] for (size, count) in lengths)
+                    if cost < best[0]:
+                        best = (cost, chunks, True)
+
+        plans[(n, r)] = best
+        return best
+
+    # if no plan works then we cry Uncle and give up
+    if plan(0, room)[0] == math.inf:
         raise URLError()
 
-    for elem in parts:
-        kw[var] = elem
-        for u2 in _refetch_url(url, variables[0], variables[1:], **kw):
-            yield u2
+    # the work list holds finished URLs and (variable index, room, arguments) tuples that still
+    # need chunking. Items are pushed in reverse so that URLs come out in their natural order
+    stack = [(0, room, kwargs)]
+    while stack:
+        item = stack.pop()
+        if type(item) is str:
+            yield item
+            continue
+
+        (n, r, kw) = item
+        (_, chunks, deeper) = plan(n, r)
+        for elem in reversed(chunks):
+            kw2 = kw.copy()
+            kw2[variables[n]] = elem
+            if deeper:
+                stack.append((n+1, r - len(elem), kw2))
+            else:
+                stack.append(url.format(**kw2))
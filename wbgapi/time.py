@@ -74,10 +74,14 @@ def periods(db=None):
 
     v = _time_values.get(db)
     if v is None:
-        v = {}
-        for row in w.source.features('time', 'all', db=db):
-            v[row['value']] = row['id']
+        def lookup():
+            v = {}
+            for row in w.source.features('time', 'all', db=db):
+                v[row['value']] = row['id']
 
+            return v
+
+        v = w._cachedLookup(('time', str(db)), lookup)
         _time_values[db] = v
 
     return v